@@ -5,7 +5,6 @@ import tempfile
 from typing import List
 
 from aiogram import types
-from pydub import AudioSegment
 
 from app.bot.message_processor import MessageProcessor
 from app.bot.utils import TypingWorker, message_is_forward, get_username, Timer
@@ -113,12 +112,13 @@ class BatchedInputHandler:
             async with TypingWorker(self.bot, first_message.chat.id).typing_context():
                 await self.answer_message(message, user, message_processor)
         except Exception as e:
-            await message.answer(f'Something went wrong:\n{str(type(e))}\n{e}')
-            raise
+            # error is handled here, re-raising it would only make aiogram log the same traceback once more
+            logger.exception('Failed to answer message of user %s', user.id)
+            await message.answer(f'Something went wrong:\n{type(e).__name__}\n{e}')
 
     async def handle_voice(self, message: types.Message, user: User, message_processor: MessageProcessor):
         """
-        Handles voice message. Downloads voice file, converts it to mp3, sends it to whisper, sends response to user,
+        Handles voice message. Downloads voice file, sends it to whisper, sends response to user,
         adds response to context.
         """
         file = await self.bot.get_file(message.voice.file_id)
@@ -129,13 +129,16 @@ class BatchedInputHandler:
         async with TypingWorker(self.bot, message.chat.id).typing_context():
             with tempfile.TemporaryDirectory() as temp_dir:
                 ogg_filepath = os.path.join(temp_dir, f'voice_{message.voice.file_id}.ogg')
-                mp3_filename = os.path.join(temp_dir, f'voice_{message.voice.file_id}.mp3')
                 await self.bot.download_file(file.file_path, destination=ogg_filepath)
-                audio = AudioSegment.from_ogg(ogg_filepath)
-                audio_length_seconds = len(audio) // 1000 + 1
-                await self.db.create_whisper_usage(user.id, audio_length_seconds)
-                audio.export(mp3_filename, format="mp3")
-                speech_text = await get_audio_speech_to_text(mp3_filename)
+                # telegram reports duration in whole seconds, add a second to round up partial one
+                audio_length_seconds = message.voice.duration + 1
+                # usage record and dialog context don't depend on transcription, they are processed meanwhile
+                # whisper accepts telegram ogg/opus voice files as is
+                _, speech_text, _ = await asyncio.gather(
+                    self.db.create_whisper_usage(user.id, audio_length_seconds),
+                    get_audio_speech_to_text(ogg_filepath),
+                    message_processor.context_manager(),
+                )
                 speech_text = f'speech2text:\n{speech_text}'
 
         response = await message.reply(speech_text)
@@ -1,19 +1,80 @@
-from typing import List, AsyncGenerator, Callable
+import logging
+from typing import List, AsyncGenerator, Callable, Optional, Tuple
 
+import settings
 from app.openai_helpers.chatgpt import DialogMessage
+from app.openai_helpers.response_cache import ResponseCache, SemanticResponseCache, SemanticCacheKey
 from app.storage.db import DB, User
 
 
+logger = logging.getLogger(__name__)
+
+
 class ChatGptManager:
     def __init__(self, chatgpt, db):
         self.chatgpt = chatgpt
         self.db: DB = db
 
-    async def send_user_message(self, user: User, messages: List[DialogMessage], is_cancelled: Callable[[], bool]) -> AsyncGenerator[DialogMessage, None]:
+    async def send_user_message(self, user: User, messages: List[DialogMessage], is_cancelled: Callable[[], bool]) -> Tuple[AsyncGenerator[DialogMessage, None], bool]:
+        # returns response generator and whether it's streaming, cached response is sent as a whole like sync one
+        cache_key = None
+        if settings.ENABLE_RESPONSE_CACHE:
+            cache_key = ResponseCache.build_key(*self.get_cache_scope(), messages)
+            cached_message = ResponseCache.instance().get(cache_key)
+            if cached_message is not None:
+                return self.send_cached_message(cached_message), False
+
+        semantic_cache_key = None
+        if settings.ENABLE_SEMANTIC_RESPONSE_CACHE:
+            semantic_cache_key = await self.get_semantic_cache_key(user, messages)
+            if semantic_cache_key is not None:
+                cached_message = SemanticResponseCache.instance().get(semantic_cache_key)
+                if cached_message is not None:
+                    return self.send_cached_message(cached_message), False
+
         if user.streaming_answers:
-            return self.send_user_message_streaming(user, messages, is_cancelled)
+            response_generator = self.send_user_message_streaming(user, messages, is_cancelled)
         else:
-            return self.send_user_message_sync(user, messages)
+            response_generator = self.send_user_message_sync(user, messages)
+
+        if cache_key is not None or semantic_cache_key is not None:
+            response_generator = self.cache_response(response_generator, is_cancelled, cache_key, semantic_cache_key)
+        return response_generator, user.streaming_answers
+
+    def get_cache_scope(self):
+        function_storage = self.chatgpt.function_storage
+        functions = function_storage.get_openai_prompt() if function_storage is not None else None
+        return self.chatgpt.model, self.chatgpt.gpt_mode, functions
+
+    async def get_semantic_cache_key(self, user: User, messages: List[DialogMessage]) -> Optional[SemanticCacheKey]:
+        prompt = SemanticResponseCache.get_standalone_prompt(messages)
+        if prompt is None:
+            return None
+        try:
+            return await SemanticResponseCache.build_key(user.id, *self.get_cache_scope(), prompt)
+        except Exception:
+            # cache is an optimization, failed embedding request shouldn't break the answer
+            logger.exception('Failed to build semantic cache key')
+            return None
+
+    @staticmethod
+    async def send_cached_message(dialog_message: DialogMessage) -> AsyncGenerator[DialogMessage, None]:
+        yield dialog_message
+
+    @staticmethod
+    async def cache_response(response_generator: AsyncGenerator[DialogMessage, None], is_cancelled: Callable[[], bool],
+                             cache_key: Optional[str], semantic_cache_key: Optional[SemanticCacheKey]) -> AsyncGenerator[DialogMessage, None]:
+        dialog_message = None
+        async for dialog_message in response_generator:
+            yield dialog_message
+
+        # function calls are not cached since function results may change, cancelled response is incomplete
+        if dialog_message is None or dialog_message.function_call or is_cancelled():
+            return
+        if cache_key is not None:
+            ResponseCache.instance().set(cache_key, dialog_message)
+        if semantic_cache_key is not None:
+            SemanticResponseCache.instance().set(semantic_cache_key, dialog_message)
 
     async def send_user_message_sync(self, user: User, messages: List[DialogMessage]) -> AsyncGenerator[DialogMessage, None]:
         dialog_message, completion_usage = await self.chatgpt.send_messages(messages)
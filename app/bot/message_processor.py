@@ -1,6 +1,8 @@
+import asyncio
+import re
+from bisect import bisect_left
 from contextlib import suppress
 from datetime import datetime
-from urllib.parse import urljoin
 
 from aiogram.utils.exceptions import BadRequest
 
@@ -19,6 +21,10 @@ from aiogram.types import Message, ParseMode, InlineKeyboardMarkup
 WAIT_BETWEEN_MESSAGE_UPDATES = 2
 TELEGRAM_MESSAGE_LENGTH_CUTOFF = 4080
 
+CANCEL_KEYBOARD = InlineKeyboardMarkup().add(get_cancel_button())
+
+IMAGE_PROXY_BASE_URL = f'{settings.IMAGE_PROXY_URL}:{settings.IMAGE_PROXY_PORT}/'
+
 
 class MessageProcessor:
     def __init__(self, db: DB, user: User, message: Message):
@@ -60,7 +66,7 @@ class MessageProcessor:
             # it's the only place in code where we know image size
             # maybe we should add it to DialogMessage as metadata?
             tokens = calculate_image_tokens(photo.width, photo.height)
-            file_url = urljoin(f'{settings.IMAGE_PROXY_URL}:{settings.IMAGE_PROXY_PORT}', f'{file_id}_{tokens}.jpg')
+            file_url = f'{IMAGE_PROXY_BASE_URL}{file_id}_{tokens}.jpg'
             content.append(DialogUtils.construct_message_content_part(DialogUtils.CONTENT_IMAGE_URL, file_url))
 
         return DialogUtils.prepare_user_message(content)
@@ -72,15 +78,21 @@ class MessageProcessor:
         chat_gpt_manager = ChatGptManager(ChatGPT(self.user.current_model, self.user.gpt_mode, function_storage), self.db)
 
         context_dialog_messages = await context_manager.get_context_messages()
-        response_generator = await chat_gpt_manager.send_user_message(self.user, context_dialog_messages, is_cancelled)
+        response_generator, is_streaming = await chat_gpt_manager.send_user_message(
+            self.user, context_dialog_messages, is_cancelled
+        )
 
         await self.handle_gpt_response(
-            chat_gpt_manager, context_manager, response_generator, function_storage, is_cancelled
+            chat_gpt_manager, context_manager, response_generator, is_streaming, function_storage, is_cancelled
         )
 
-    async def handle_gpt_response(self, chat_gpt_manager, context_manager, response_generator, function_storage, is_cancelled):
-        response_dialog_message, message_id = await self.handle_response_generator(response_generator)
-        if response_dialog_message.function_call:
+    async def handle_gpt_response(self, chat_gpt_manager, context_manager, response_generator, is_streaming, function_storage, is_cancelled):
+        # function calls are handled in a loop until gpt returns a regular message
+        while True:
+            response_dialog_message, message_id = await self.handle_response_generator(response_generator, is_streaming)
+            if not response_dialog_message.function_call:
+                break
+
             function_name = response_dialog_message.function_call.name
             function_args = response_dialog_message.function_call.arguments
             function_response_raw = await function_storage.run_function(function_name, function_args)
@@ -94,37 +106,47 @@ class MessageProcessor:
                     function_response_tg_message = await send_telegram_message(self.message, function_response_text)
                     function_response_message_id = function_response_tg_message.message_id
             context_dialog_messages = await context_manager.add_message(function_response, function_response_message_id)
-            response_generator = await chat_gpt_manager.send_user_message(self.user, context_dialog_messages, is_cancelled)
-
-            await self.handle_gpt_response(chat_gpt_manager, context_manager, response_generator, function_storage, is_cancelled)
-        else:
-            dialog_messages = self.split_dialog_message(response_dialog_message)
+            response_generator, is_streaming = await chat_gpt_manager.send_user_message(
+                self.user, context_dialog_messages, is_cancelled
+            )
+
+        # cheap check to skip regex scan of every part when there is no code at all
+        has_code = '```' in response_dialog_message.content
+        dialog_messages = self.split_dialog_message(response_dialog_message)
+        add_message_task = None
+        try:
             for dialog_message in dialog_messages:
-                code_fragments = detect_and_extract_code(dialog_message.content)
+                code_fragments = has_code and detect_and_extract_code(dialog_message.content)
                 parse_mode = ParseMode.MARKDOWN if code_fragments else None
                 if message_id is not None:
                     response = await edit_telegram_message(self.message, dialog_message.content, message_id, parse_mode)
                     message_id = None
                 else:
                     response = await send_telegram_message(self.message, dialog_message.content, parse_mode)
-                await context_manager.add_message(dialog_message, response.message_id)
-
-    async def handle_response_generator(self, response_generator):
+                # context messages must be stored in order, but previous one is stored while this part is being sent
+                if add_message_task is not None:
+                    await add_message_task
+                add_message_task = asyncio.create_task(context_manager.add_message(dialog_message, response.message_id))
+        finally:
+            # already sent part must be stored even if sending of the next one failed
+            if add_message_task is not None:
+                await add_message_task
+
+    async def handle_response_generator(self, response_generator, is_streaming):
         dialog_message = None
         message_id = None
         chat_id = None
-        previous_content = None
+        previous_content_length = None
         previous_time = None
-
-        keyboard = InlineKeyboardMarkup()
-        keyboard.add(get_cancel_button())
+        scanned_length = 0
+        last_space_index = 0
 
         message_too_long_for_telegram = False
-        first_iteration = True
+        # at most one message edit is in flight, updates received meanwhile are coalesced into the next edit
+        edit_task = None
         async for dialog_message in response_generator:
-            if first_iteration:
-                # HACK: skip first iteration for case with full synchronous openai response
-                first_iteration = False
+            if not is_streaming:
+                # full synchronous openai or cached response, it's sent by caller
                 continue
 
             if message_too_long_for_telegram:
@@ -133,31 +155,51 @@ class MessageProcessor:
             if dialog_message.function_call is not None:
                 continue
 
-            new_content = ' '.join(dialog_message.content.strip().split(' ')[:-1]) if dialog_message.content else ''
-            if len(new_content) < 50:
+            # cut off last (possibly incomplete) word, only the part received since previous chunk is scanned
+            content = dialog_message.content or ''
+            tail_space_index = content.rfind(' ', scanned_length)
+            if tail_space_index != -1:
+                last_space_index = tail_space_index
+            scanned_length = len(content)
+            # content is cut only when message is actually edited, its length is the last space index
+            if last_space_index < 50:
                 continue
 
             # send message
             if not message_id:
-                resp = await send_telegram_message(self.message, dialog_message.content, reply_markup=keyboard)
+                resp = await send_telegram_message(self.message, dialog_message.content, reply_markup=CANCEL_KEYBOARD)
                 chat_id = self.message.chat.id
                 # hack: most telegram clients remove "typing" status after receiving new message from bot
                 await self.message.bot.send_chat_action(chat_id, 'typing')
                 message_id = resp.message_id
-                previous_content = dialog_message.content
+                previous_content_length = len(dialog_message.content)
                 previous_time = datetime.now()
                 continue
 
             # update message
+            if edit_task is not None:
+                if not edit_task.done():
+                    continue
+                # raise exception of the previous edit if any
+                edit_task.result()
+                edit_task = None
+
             time_passed_seconds = (datetime.now() - previous_time).seconds
-            if previous_content != new_content and time_passed_seconds >= WAIT_BETWEEN_MESSAGE_UPDATES:
+            if previous_content_length != last_space_index and time_passed_seconds >= WAIT_BETWEEN_MESSAGE_UPDATES:
+                new_content = content[:last_space_index]
                 if len(new_content) > TELEGRAM_MESSAGE_LENGTH_CUTOFF:
                     # stop updating message if it's too long
                     message_too_long_for_telegram = True
                     new_content = f'{new_content[:TELEGRAM_MESSAGE_LENGTH_CUTOFF]} ⏳...'
-                await self.message.bot.edit_message_text(new_content, chat_id, message_id, reply_markup=keyboard)
-                previous_content = new_content
+                edit_task = asyncio.create_task(
+                    self.message.bot.edit_message_text(new_content, chat_id, message_id, reply_markup=CANCEL_KEYBOARD)
+                )
+                previous_content_length = last_space_index
                 previous_time = datetime.now()
+
+        if edit_task is not None:
+            # final edit is made by caller, pending update must not overwrite it
+            await edit_task
         return dialog_message, message_id
 
     @staticmethod
@@ -169,19 +211,29 @@ class MessageProcessor:
         if len(content) <= max_content_length:
             return [dialog_message]
 
+        # separator positions in order of priority: new lines, then sentences, then words
+        separators_positions = [
+            [match.start() for match in re.finditer(re.escape(separator), content)]
+            for separator in ['\n', '.', ' ']
+        ]
+
         parts = []
-        while len(content) > max_content_length:
-            # find last space
-            for separator in ['\n', '.', ' ']:
-                last_space_index = content.rfind(separator, 0, max_content_length)
-                if last_space_index != -1:
+        offset = 0
+        while len(content) - offset > max_content_length:
+            cutoff = offset + max_content_length
+            # find last separator before cutoff
+            split_index = -1
+            for positions in separators_positions:
+                position_index = bisect_left(positions, cutoff) - 1
+                if position_index >= 0 and positions[position_index] >= offset:
+                    split_index = positions[position_index]
                     break
-            if last_space_index == -1:
-                # no spaces, just split by max_content_length
-                parts.append(content[:max_content_length])
-                content = content[max_content_length:]
+            if split_index == -1:
+                # no separators, just split by max_content_length
+                parts.append(content[offset:cutoff])
+                offset = cutoff
             else:
-                parts.append(content[:last_space_index])
-                content = content[last_space_index + 1:]
-        parts.append(content)
+                parts.append(content[offset:split_index])
+                offset = split_index + 1
+        parts.append(content[offset:])
         return [dialog_message.copy(update={"content": part}) for part in parts]
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import datetime
 import tempfile
@@ -46,7 +47,8 @@ class TelegramBot:
     async def on_startup(self, _):
         self.db = await DBFactory.create_database(
             settings.POSTGRES_USER, settings.POSTGRES_PASSWORD,
-            settings.POSTGRES_HOST, settings.POSTGRES_PORT, settings.POSTGRES_DATABASE
+            settings.POSTGRES_HOST, settings.POSTGRES_PORT, settings.POSTGRES_DATABASE,
+            settings.POSTGRES_POOL_MIN_SIZE, settings.POSTGRES_POOL_MAX_SIZE,
         )
         self.settings = Settings(self.bot, self.dispatcher, self.db)
         self.cancellation_manager = CancellationManager(self.bot, self.dispatcher)
@@ -107,10 +109,12 @@ class TelegramBot:
 
     async def get_usage(self, message: types.Message, user: User):
         await self.bot.delete_message(message.chat.id, message.message_id)
-        whisper_usage = await self.db.get_user_current_month_whisper_usage(user.id)
+        whisper_usage, completion_usages = await asyncio.gather(
+            self.db.get_user_current_month_whisper_usage(user.id),
+            self.db.get_user_current_month_completion_usage(user.id),
+        )
         whisper_price = calculate_whisper_usage_price(whisper_usage)
 
-        completion_usages = await self.db.get_user_current_month_completion_usage(user.id)
         result = []
         total = whisper_price
         for usage in completion_usages:
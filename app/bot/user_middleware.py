@@ -22,15 +22,20 @@ class UserMiddleware(BaseMiddleware):
             user = await self.db.create_user(user_id, settings.USER_ROLE_DEFAULT)
             is_new_user = True
 
+        # all user changes are saved with a single update
+        user_changed = False
         if user.role is None:
             user.role = settings.USER_ROLE_DEFAULT
-            await self.db.update_user(user)
+            user_changed = True
 
         full_name = message.from_user.full_name
         username = message.from_user.username
         if user.full_name != full_name or user.username != username:
             user.full_name = full_name
             user.username = username
+            user_changed = True
+
+        if user_changed:
             await self.db.update_user(user)
 
         if settings.ENABLE_USER_ROLE_MANAGER_CHAT and is_new_user:
@@ -83,9 +83,11 @@ class CodeFragment:
     code: str
 
 
+CODE_PATTERN = re.compile(r"```(\S+)\n(.*?)```", re.DOTALL)
+
+
 def detect_and_extract_code(text) -> List[CodeFragment]:
-    pattern = r"```(\S+)\n(.*?)```"
-    matches = re.findall(pattern, text, re.DOTALL)
+    matches = CODE_PATTERN.findall(text)
     results = []
     for match in matches:
         language, code = match
@@ -123,12 +125,43 @@ def escape_tg_markdown(text):
     return ''.join('\\' + char if char in escape_chars else char for char in text)
 
 
+ESCAPED_MARKDOWN_PATTERN = re.compile(r'\\[_*`\[]')
+
+
+def markdown_is_valid(text: str) -> bool:
+    """
+    Rough check that all entities of telegram markdown are closed, so message can be sent without CantParseEntities
+    """
+    text = ESCAPED_MARKDOWN_PATTERN.sub('', text)
+    code_block_parts = text.split('```')
+    if len(code_block_parts) % 2 == 0:
+        return False
+    # even parts are outside of code blocks
+    for part in code_block_parts[::2]:
+        inline_code_parts = part.split('`')
+        if len(inline_code_parts) % 2 == 0:
+            return False
+        for text_part in inline_code_parts[::2]:
+            if text_part.count('*') % 2 or text_part.count('_') % 2:
+                return False
+    return True
+
+
+def check_parse_mode(text: str, parse_mode):
+    if parse_mode == types.ParseMode.MARKDOWN and not markdown_is_valid(text):
+        return None
+    return parse_mode
+
+
 async def send_telegram_message(message: types.Message, text: str, parse_mode=None, reply_markup=None):
     if message.reply_to_message is None:
         send_message = message.answer
     else:
         send_message = message.reply
 
+    # avoid extra request to telegram if markdown is obviously broken
+    parse_mode = check_parse_mode(text, parse_mode)
+
     try:
         return await send_message(text, parse_mode=parse_mode, reply_markup=reply_markup)
     except CantParseEntities:
@@ -138,6 +171,7 @@ async def send_telegram_message(message: types.Message, text: str, parse_mode=No
 
 async def edit_telegram_message(message: types.Message, text: str, message_id, parse_mode=None):
     chat_id = message.chat.id
+    parse_mode = check_parse_mode(text, parse_mode)
     try:
         return await message.bot.edit_message_text(text, chat_id, message_id,  parse_mode=parse_mode)
     except CantParseEntities:
@@ -162,8 +196,10 @@ def merge_dicts(dict_1, dict_2):
 
 
 async def get_completion_usage_response_all_users(db, month_date: date = None) -> str:
-    completion_usages = await db.get_all_users_completion_usage(month_date)
-    whisper_usages = await db.get_all_users_whisper_usage(month_date)
+    completion_usages, whisper_usages = await asyncio.gather(
+        db.get_all_users_completion_usage(month_date),
+        db.get_all_users_whisper_usage(month_date),
+    )
     result = []
     for name, user_completion_usages in completion_usages.items():
         user_usage_price = 0
@@ -10,7 +10,7 @@ from app.openai_helpers.function_storage import FunctionStorage
 from app.storage.db import DB, User
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True, slots=True)
 class ContextConfiguration:
     model_name: str
 
@@ -23,43 +23,46 @@ class ContextConfiguration:
 
     @staticmethod
     def get_config(model: str):
-        if model == 'gpt-3.5-turbo':
-            return ContextConfiguration(
-                model_name=model,
-                long_term_memory_tokens=512,
-                short_term_memory_tokens=2560,
-                summary_length=512,
-            )
-        elif model == 'gpt-3.5-turbo-16k':
-            return ContextConfiguration(
-                model_name=model,
-                long_term_memory_tokens=1024,
-                short_term_memory_tokens=4096,
-                summary_length=1024,
-            )
-        elif model == 'gpt-4':
-            return ContextConfiguration(
-                model_name=model,
-                long_term_memory_tokens=512,
-                short_term_memory_tokens=2048,
-                summary_length=1024,
-            )
-        elif model == 'gpt-4-1106-preview':
-            return ContextConfiguration(
-                model_name=model,
-                long_term_memory_tokens=512,
-                short_term_memory_tokens=5120,
-                summary_length=2048,
-            )
-        elif model == 'gpt-4-vision-preview':
-            return ContextConfiguration(
-                model_name=model,
-                long_term_memory_tokens=512,
-                short_term_memory_tokens=5120,
-                summary_length=2048,
-            )
-        else:
+        context_configuration = CONTEXT_CONFIGURATIONS.get(model)
+        if context_configuration is None:
             raise ValueError(f'Unknown model name: {model}')
+        return context_configuration
+
+
+CONTEXT_CONFIGURATIONS = {
+    config.model_name: config for config in [
+        ContextConfiguration(
+            model_name='gpt-3.5-turbo',
+            long_term_memory_tokens=512,
+            short_term_memory_tokens=2560,
+            summary_length=512,
+        ),
+        ContextConfiguration(
+            model_name='gpt-3.5-turbo-16k',
+            long_term_memory_tokens=1024,
+            short_term_memory_tokens=4096,
+            summary_length=1024,
+        ),
+        ContextConfiguration(
+            model_name='gpt-4',
+            long_term_memory_tokens=512,
+            short_term_memory_tokens=2048,
+            summary_length=1024,
+        ),
+        ContextConfiguration(
+            model_name='gpt-4-1106-preview',
+            long_term_memory_tokens=512,
+            short_term_memory_tokens=5120,
+            summary_length=2048,
+        ),
+        ContextConfiguration(
+            model_name='gpt-4-vision-preview',
+            long_term_memory_tokens=512,
+            short_term_memory_tokens=5120,
+            summary_length=2048,
+        ),
+    ]
+}
 
 
 class ContextManager:
@@ -7,6 +7,9 @@ from app.storage.db import DB, User
 
 
 class FunctionManager:
+    # static functions depend only on settings, their storage is built once and shared between users
+    _static_function_storage = None
+
     def __init__(self, db: DB, user: User):
         self.db = db
         self.user = user
@@ -25,16 +28,21 @@ class FunctionManager:
         if not self.user.use_functions:
             return None
 
-        functions = self.get_static_functions()
-        if not functions:
+        function_storage = self.get_static_function_storage()
+        if not function_storage.functions:
             return None
 
-        function_storage = FunctionStorage()
-        for function in functions:
-            function_storage.register(function)
-
         self.function_storage = function_storage
         return function_storage
 
+    @classmethod
+    def get_static_function_storage(cls) -> FunctionStorage:
+        if cls._static_function_storage is None:
+            function_storage = FunctionStorage()
+            for function in cls.get_static_functions():
+                function_storage.register(function)
+            cls._static_function_storage = function_storage
+        return cls._static_function_storage
+
     def get_function_storage(self) -> Optional[FunctionStorage]:
         return self.function_storage
@@ -126,7 +126,7 @@ class ChatGPT:
             functions = self.function_storage.get_openai_prompt()
             prompt_tokens += count_tokens_from_functions(functions, self.model)
             additional_fields.update({
-                'functions': self.function_storage.get_openai_prompt(),
+                'functions': functions,
                 'function_call': 'auto',
             })
 
@@ -189,6 +189,8 @@ class ChatGPT:
 
     @staticmethod
     def create_context(messages: List[DialogMessage], gpt_mode) -> List[Any]:
+        # system prompt and summary (first dialog message) must stay first and unchanged between turns,
+        # so request prefix is byte-identical and hits openai prompt caching
         system_prompt = settings.gpt_mode[gpt_mode]["system"]
 
         result = [{"role": "system", "content": system_prompt}]
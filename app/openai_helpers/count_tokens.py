@@ -1,6 +1,8 @@
+import functools
+import json
 import logging
 
-from typing import Iterable, List
+from typing import List
 import tiktoken
 
 
@@ -11,6 +13,9 @@ HIGH_DETAIL_ADDITIONAL_COST = 85
 FIRST_SCALE_TO_PX = 2048
 SECOND_SCALE_TO_PX = 768
 
+# every reply is primed with <|start|>assistant<|message|>
+REPLY_PRIMING_TOKENS = 3
+
 
 logger = logging.getLogger(__name__)
 
@@ -38,44 +43,55 @@ def extract_tokens_count_from_image_url(image_url):
     return tokens
 
 
-def count_messages_tokens(messages: List[dict], model="gpt-3.5-turbo") -> int:
+def count_message_tokens(message: dict, model="gpt-3.5-turbo") -> int:
     # numbers for currently actual models (gpt-3.5-turbo-0613, gpt-4-0314 and older)
     tokens_per_message = 3
     tokens_per_name = 1
 
     encoding = tiktoken.encoding_for_model(model)
 
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        content = message.get('content')
-        if content:
-            if isinstance(content, str):
-                num_tokens += len(encoding.encode(content))
-            elif isinstance(content, list):
-                for part in content:
-                    if part['type'] == 'text':
-                        num_tokens += len(encoding.encode(part['text']))
-                    elif part['type'] == 'image_url':
-                        num_tokens += extract_tokens_count_from_image_url(part['image_url'])
-                    else:
-                        ValueError('Unknown content type')
-
-        for key, value in message.items():
-            if key == 'content':
-                continue
-            if value is None:
-                continue
-            num_tokens += len(encoding.encode(str(value)))
-            if key == "name":
-                num_tokens += tokens_per_name
-
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+    num_tokens = tokens_per_message
+    content = message.get('content')
+    if content:
+        if isinstance(content, str):
+            num_tokens += len(encoding.encode(content))
+        elif isinstance(content, list):
+            for part in content:
+                if part['type'] == 'text':
+                    num_tokens += len(encoding.encode(part['text']))
+                elif part['type'] == 'image_url':
+                    num_tokens += extract_tokens_count_from_image_url(part['image_url'])
+                else:
+                    ValueError('Unknown content type')
+
+    for key, value in message.items():
+        if key == 'content':
+            continue
+        if value is None:
+            continue
+        num_tokens += len(encoding.encode(str(value)))
+        if key == "name":
+            num_tokens += tokens_per_name
+
     return num_tokens
 
 
-def count_dialog_messages_tokens(messages: Iterable['DialogMessage'], model="gpt-3.5-turbo") -> int:
-    return count_messages_tokens([m.openai_message() for m in messages], model)
+def count_messages_tokens(messages: List[dict], model="gpt-3.5-turbo") -> int:
+    num_tokens = sum(count_message_tokens(message, model) for message in messages)
+    return num_tokens + REPLY_PRIMING_TOKENS
+
+
+@functools.lru_cache(maxsize=4096)
+def _count_serialized_message_tokens(serialized_message: str, model: str) -> int:
+    return count_message_tokens(json.loads(serialized_message), model)
+
+
+def count_dialog_message_tokens(message: 'DialogMessage', model="gpt-3.5-turbo") -> int:
+    """
+    Count tokens of a single dialog message without reply priming, results are cached by message content
+    """
+    serialized_message = json.dumps(message.openai_message(), sort_keys=True)
+    return _count_serialized_message_tokens(serialized_message, model)
 
 
 def count_tokens_from_functions(functions, model="gpt-3.5-turbo"):
@@ -120,6 +136,7 @@ def count_tokens_from_functions(functions, model="gpt-3.5-turbo"):
     return num_tokens
 
 
+@functools.lru_cache(maxsize=256)
 def calculate_image_tokens(width, height, low_detail=False) -> int:
     if low_detail:
         return LOW_DETAIL_COST
@@ -18,13 +18,13 @@ class EmbeddedText:
     embedding: List[float]
 
 
-async def get_embeddings(strings: List[str]) -> List[EmbeddedText]:
+async def get_embeddings(strings: List[str], model: str = EMBEDDING_MODEL) -> List[EmbeddedText]:
     response = await OpenAIAsync.instance().embeddings.create(
-        model=EMBEDDING_MODEL,
+        model=model,
         input=strings,
     )
     result = []
-    for string, embedding_openai in zip(strings, response['data']):
+    for string, embedding_openai in zip(strings, response.data):
         embedding = embedding_openai.embedding
         result.append(EmbeddedText(string, embedding))
     return result
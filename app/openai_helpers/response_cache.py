@@ -0,0 +1,133 @@
+import dataclasses
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+import settings
+from app.openai_helpers.chatgpt import DialogMessage
+from app.openai_helpers.embeddings import get_embeddings
+
+
+class ResponseCache:
+    """
+    In-process LRU cache of gpt responses, key is built from model, gpt mode, functions and exact dialog context
+    """
+    _instance = None
+
+    def __init__(self, ttl_seconds: int, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(settings.RESPONSE_CACHE_TTL, settings.RESPONSE_CACHE_MAX_SIZE)
+        return cls._instance
+
+    @staticmethod
+    def build_key(model: str, gpt_mode: str, functions: Optional[list], messages: List[DialogMessage]) -> str:
+        data = [model, gpt_mode, functions, [m.openai_message() for m in messages]]
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[DialogMessage]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expiration_time, dialog_message = entry
+        if expiration_time < time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return dialog_message.copy()
+
+    def set(self, key: str, dialog_message: DialogMessage):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, dialog_message.copy())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+@dataclasses.dataclass
+class SemanticCacheKey:
+    # hash of user, model, gpt mode and functions, responses are matched only within the same scope
+    scope: str
+    embedding: np.ndarray
+
+
+class SemanticResponseCache:
+    """
+    In-process cache of gpt responses to standalone prompts, prompts are matched by cosine similarity of embeddings
+    """
+    _instance = None
+
+    def __init__(self, similarity_threshold: float, ttl_seconds: int, max_size: int):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        # ring buffer of entries, all entries have the same ttl so the oldest one is overwritten first
+        # embeddings matrix is allocated on first set, when embedding size is known
+        self._embeddings = None
+        self._expiration_times = np.full(max_size, -np.inf)
+        self._scopes = np.full(max_size, None, dtype=object)
+        self._responses = [None] * max_size
+        self._next_index = 0
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(
+                settings.SEMANTIC_RESPONSE_CACHE_SIMILARITY, settings.RESPONSE_CACHE_TTL, settings.RESPONSE_CACHE_MAX_SIZE
+            )
+        return cls._instance
+
+    @staticmethod
+    def get_standalone_prompt(messages: List[DialogMessage]) -> Optional[str]:
+        # same question may need another answer in another context, so only prompts without context are cached
+        if len(messages) != 1 or messages[0].role != 'user':
+            return None
+        content = messages[0].content
+        if isinstance(content, list) and any(part.type != 'text' for part in content):
+            return None
+        prompt = messages[0].get_text_content()
+        return prompt if prompt else None
+
+    @staticmethod
+    async def build_key(user_id: int, model: str, gpt_mode: str, functions: Optional[list], prompt: str) -> SemanticCacheKey:
+        # answer to a similar prompt may contain personal details, so responses are never shared between users
+        scope = ResponseCache.build_key(model, gpt_mode, functions, []) + f':{user_id}'
+        embedded_text, = await get_embeddings([prompt], settings.SEMANTIC_RESPONSE_CACHE_EMBEDDING_MODEL)
+        embedding = np.array(embedded_text.embedding, dtype=np.float32)
+        return SemanticCacheKey(scope, embedding / np.linalg.norm(embedding))
+
+    def get(self, key: SemanticCacheKey) -> Optional[DialogMessage]:
+        if self._embeddings is None:
+            return None
+
+        matching = (self._expiration_times >= time.monotonic()) & (self._scopes == key.scope)
+        if not matching.any():
+            return None
+
+        similarities = self._embeddings @ key.embedding
+        similarities[~matching] = -np.inf
+        best_index = int(np.argmax(similarities))
+        if similarities[best_index] < self.similarity_threshold:
+            return None
+        return self._responses[best_index].copy()
+
+    def set(self, key: SemanticCacheKey, dialog_message: DialogMessage):
+        if self._embeddings is None:
+            self._embeddings = np.zeros((self.max_size, key.embedding.shape[0]), dtype=np.float32)
+
+        index = self._next_index
+        self._embeddings[index] = key.embedding
+        self._expiration_times[index] = time.monotonic() + self.ttl_seconds
+        self._scopes[index] = key.scope
+        self._responses[index] = dialog_message.copy()
+        self._next_index = (index + 1) % self.max_size
@@ -1,4 +1,3 @@
-import json
 from collections import defaultdict
 from datetime import datetime, date
 from enum import Enum
@@ -9,6 +8,7 @@ from app.openai_helpers.chatgpt import DialogMessage, CompletionUsage
 from app.storage.user_role import UserRole
 
 import asyncpg
+import orjson
 import pydantic
 
 
@@ -86,28 +86,37 @@ class DB:
         sql = 'INSERT INTO chatgpttg.user (telegram_id, role) VALUES ($1, $2) RETURNING *'
         return User(**await self.connection_pool.fetchrow(sql, telegram_user_id, role.value))
 
-    async def get_telegram_message(self, tg_chat_id: int, tg_message_id: int):
-        sql = 'SELECT * FROM chatgpttg.message WHERE tg_chat_id = $1 AND tg_message_id = $2'
-        tg_message_record = await self.connection_pool.fetchrow(sql, tg_chat_id, tg_message_id)
-        if tg_message_record is None:
-            return None
-        tg_message_record = dict(tg_message_record)
-        tg_message_record['message'] = json.loads(tg_message_record['message'])
-        return Message(**tg_message_record)
-
-    async def get_messages_by_ids(self, message_ids: List[int]):
-        sql = 'SELECT * FROM chatgpttg.message WHERE id = ANY($1::bigint[]) ORDER BY cdate ASC'
-        records = await self.connection_pool.fetch(sql, message_ids)
-        if records is None:
-            return []
+    async def get_dialog_window(self, user_id, tg_chat_id, reply_to_tg_message_id: Optional[int] = None,
+                                expiration_window_seconds: Optional[int] = None) -> List[Message]:
+        """
+        Fetch anchor message with all previous messages of its branch in one query.
+        Anchor is the replied message if reply_to_tg_message_id is passed, otherwise the last message in chat
+        (skipped if it wasn't activated within expiration window). Anchor is always the last element.
+        """
+        if reply_to_tg_message_id is not None:
+            anchor_sql = 'SELECT * FROM chatgpttg.message WHERE tg_chat_id = $1 AND tg_message_id = $2 LIMIT 1'
+            args = [tg_chat_id, reply_to_tg_message_id]
+        else:
+            anchor_sql = '''SELECT * FROM (
+                SELECT * FROM chatgpttg.message WHERE user_id = $1 AND tg_chat_id = $2 ORDER BY cdate DESC LIMIT 1
+            ) last_message WHERE $3::int IS NULL OR activation_dtime >= NOW() - make_interval(secs => $3::int)'''
+            args = [user_id, tg_chat_id, expiration_window_seconds]
+
+        # previous_message_ids holds the whole branch, not a link to the parent, so no recursive walk is needed
+        sql = f'''WITH anchor AS ({anchor_sql})
+        SELECT * FROM (
+            SELECT m.*, FALSE AS is_anchor FROM chatgpttg.message m JOIN anchor a ON m.id = ANY(a.previous_message_ids)
+            UNION ALL
+            SELECT *, TRUE AS is_anchor FROM anchor
+        ) dialog ORDER BY is_anchor ASC, cdate ASC'''
+        records = await self.connection_pool.fetch(sql, *args)
 
         result = []
         for record in records:
             record = dict(record)
-            record['message'] = json.loads(record['message'])
-            result.append(record)
-
-        result = [Message(**record) for record in result]
+            del record['is_anchor']
+            record['message'] = orjson.loads(record['message'])
+            result.append(Message(**record))
         return result
 
     async def get_last_message(self, user_id, tg_chat_id) -> Message:
@@ -116,7 +125,7 @@ class DB:
         if record is None:
             return None
         record = dict(record)
-        record['message'] = json.loads(record['message'])
+        record['message'] = orjson.loads(record['message'])
         return Message(**record)
 
     async def update_activation_dtime(self, message_ids: List[int]):
@@ -129,13 +138,13 @@ class DB:
             previous_messages = []
 
         sql = 'INSERT INTO chatgpttg.message (user_id, message, previous_message_ids, tg_chat_id, tg_message_id, message_type) VALUES ($1, $2, $3, $4, $5, $6) RETURNING *'
-        openai_message = json.dumps(message.openai_message())
+        openai_message = orjson.dumps(message.openai_message()).decode()
         previous_message_ids = [m.id for m in previous_messages]
 
         record = await self.connection_pool.fetchrow(sql, user_id, openai_message, previous_message_ids,
                                                      tg_chat_id, tg_message_id, message_type.value)
         record = dict(record)
-        record['message'] = json.loads(record['message'])
+        record['message'] = orjson.loads(record['message'])
         return Message(**record)
 
     async def create_reset_message(self, user_id, tg_chat_id):
@@ -156,7 +165,7 @@ class DB:
     async def get_user_current_month_whisper_usage(self, user_id):
         sql = '''SELECT SUM(audio_seconds) AS audio_seconds
             FROM chatgpttg.whisper_usage
-            WHERE user_id = $1 AND date_trunc('month', cdate) = date_trunc('month', current_date)
+            WHERE user_id = $1 AND cdate >= date_trunc('month', current_date)
         '''
         record = await self.connection_pool.fetchrow(sql, user_id)
         audio_seconds = record['audio_seconds']
@@ -171,8 +180,7 @@ class DB:
            SUM(completion_tokens) AS completion_tokens,
            SUM(total_tokens) AS total_tokens
         FROM chatgpttg.completion_usage
-        WHERE user_id = $1 AND
-          date_trunc('month', cdate) = date_trunc('month', current_date)
+        WHERE user_id = $1 AND cdate >= date_trunc('month', current_date)
         GROUP BY model;
         '''
         records = await self.connection_pool.fetch(sql, user_id)
@@ -186,17 +194,17 @@ class DB:
 
         year, month = month_date.year, month_date.month
 
-        sql = f'''
+        sql = '''
         SELECT u.telegram_id, u.username, u.full_name, cu.model, 
            SUM(cu.prompt_tokens) AS prompt_tokens, 
            SUM(cu.completion_tokens) AS completion_tokens,
            SUM(cu.total_tokens) AS total_tokens
         FROM chatgpttg.completion_usage cu
         JOIN chatgpttg.user u ON cu.user_id = u.id
-        WHERE EXTRACT(YEAR FROM cu.cdate) = {year} AND EXTRACT(MONTH FROM cu.cdate) = {month}
+        WHERE cu.cdate >= make_date($1, $2, 1) AND cu.cdate < make_date($1, $2, 1) + INTERVAL '1 month'
         GROUP BY u.id, cu.model;
         '''
-        records = await self.connection_pool.fetch(sql)
+        records = await self.connection_pool.fetch(sql, year, month)
         result = defaultdict(list)
         for record in records:
             telegram_id = record['telegram_id']
@@ -213,15 +221,15 @@ class DB:
 
         year, month = month_date.year, month_date.month
 
-        sql = f'''
+        sql = '''
         SELECT u.telegram_id, u.username, u.full_name, 
            SUM(wu.audio_seconds) AS audio_seconds
         FROM chatgpttg.whisper_usage wu
         JOIN chatgpttg.user u ON wu.user_id = u.id
-        WHERE EXTRACT(YEAR FROM wu.cdate) = {year} AND EXTRACT(MONTH FROM wu.cdate) = {month}
+        WHERE wu.cdate >= make_date($1, $2, 1) AND wu.cdate < make_date($1, $2, 1) + INTERVAL '1 month'
         GROUP BY u.id;
         '''
-        records = await self.connection_pool.fetch(sql)
+        records = await self.connection_pool.fetch(sql, year, month)
         result = {}
         for record in records:
             telegram_id = record['telegram_id']
@@ -237,10 +245,10 @@ class DBFactory:
     connection_pool = None
 
     @classmethod
-    async def create_database(cls, user, password, host, port, database) -> DB:
+    async def create_database(cls, user, password, host, port, database, pool_min_size=10, pool_max_size=10) -> DB:
         if cls.connection_pool is None:
             dsn = f'postgres://{user}:{password}@{host}:{port}/{database}'
-            cls.connection_pool = await asyncpg.create_pool(dsn)
+            cls.connection_pool = await asyncpg.create_pool(dsn, min_size=pool_min_size, max_size=pool_max_size)
 
         return DB(cls.connection_pool)
 
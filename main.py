@@ -1,4 +1,5 @@
 import logging
+import sys
 
 import settings
 from app.bot.telegram_bot import TelegramBot
@@ -6,6 +7,12 @@ from app.openai_helpers.utils import OpenAIAsync
 
 from aiogram import Bot, Dispatcher
 
+if sys.platform != 'win32':
+    import uvloop
+
+    # event loop policy must be set before aiogram creates the loop
+    uvloop.install()
+
 bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
 dp = Dispatcher(bot)
 
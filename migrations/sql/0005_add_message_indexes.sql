@@ -0,0 +1,4 @@
+-- last message in chat lookup: WHERE user_id = $1 AND tg_chat_id = $2 ORDER BY cdate DESC LIMIT 1
+CREATE INDEX IF NOT EXISTS message_user_id_tg_chat_id_cdate_idx ON chatgpttg.message USING btree(user_id, tg_chat_id, cdate DESC);
+-- replied message lookup: WHERE tg_chat_id = $1 AND tg_message_id = $2
+CREATE INDEX IF NOT EXISTS message_tg_chat_id_tg_message_id_idx ON chatgpttg.message USING btree(tg_chat_id, tg_message_id);
@@ -0,0 +1,3 @@
+-- monthly usage reports filter by cdate range
+CREATE INDEX IF NOT EXISTS completion_usage_cdate_idx ON chatgpttg.completion_usage USING btree(cdate);
+CREATE INDEX IF NOT EXISTS whisper_usage_cdate_idx ON chatgpttg.whisper_usage USING btree(cdate);
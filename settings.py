@@ -42,6 +42,19 @@ USER_ROLE_STREAMING_ANSWERS = UserRole.BASIC  # minimum role needed to use strea
 ENABLE_USER_ROLE_MANAGER_CHAT = False
 USER_ROLE_MANAGER_CHAT_ID = -1
 
+# Response cache settings
+# When enabled identical requests (same model, gpt mode, functions and dialog context) are answered from
+# in-process cache without calling openai, responses with function calls are never cached
+ENABLE_RESPONSE_CACHE = False
+RESPONSE_CACHE_TTL = 60 * 60  # 1 hour
+RESPONSE_CACHE_MAX_SIZE = 1024
+# Semantic cache answers prompts without dialog context if embedding of similar prompt of the same user is cached,
+# it costs one embedding request per such prompt
+ENABLE_SEMANTIC_RESPONSE_CACHE = False
+# threshold is calibrated for this model, text-embedding-ada-002 scores unrelated texts much higher
+SEMANTIC_RESPONSE_CACHE_EMBEDDING_MODEL = 'text-embedding-3-small'
+SEMANTIC_RESPONSE_CACHE_SIMILARITY = 0.95
+
 # Plugins settings
 ENABLE_WOLFRAMALPHA = False
 WOLFRAMALPHA_APPID = 'YOUR_TOKEN'
@@ -52,6 +65,9 @@ POSTGRES_PORT = 5432
 POSTGRES_USER = 'postgres'
 POSTGRES_PASSWORD = 'password'
 POSTGRES_DATABASE = 'chatgpttg'
+# every db query acquires its own connection from the pool, so concurrent handlers don't wait for each other
+POSTGRES_POOL_MIN_SIZE = 5
+POSTGRES_POOL_MAX_SIZE = 20
 
 # Image proxy settings
 # This proxy is used to send images to openai